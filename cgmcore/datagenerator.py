@@ -7,16 +7,21 @@ Note: This file is only here for historical reasons. And it might be gone anytim
 from __future__ import absolute_import
 import os
 import numpy as np
-import glob2
-import json
+try:
+    import orjson as json # Faster parsing if available.
+except ImportError:
+    import json
 import random
+import concurrent.futures
+import threading
+from collections import defaultdict, deque, OrderedDict
 import keras.preprocessing.image as image_preprocessing
 import progressbar
-from pyntcloud import PyntCloud
 import matplotlib.pyplot as plt
 import multiprocessing as mp
 import uuid
 import pickle
+import hashlib
 from . import utils
 
 
@@ -36,7 +41,11 @@ class DataGenerator(object):
         voxel_size_meters=0.01,
         voxelgrid_random_rotation=False,
         pointcloud_target_size=32000,
-        pointcloud_random_rotation=False
+        pointcloud_random_rotation=False,
+        number_of_workers=16,
+        cache_path=None,
+        max_cache_bytes=2 ** 32,
+        random_seed=None
         ):
         """
         Initializes a DataGenerator.
@@ -52,6 +61,10 @@ class DataGenerator(object):
             voxelgrid_random_rotation (bool): If True voxelgrids will be rotated randomly.
             pointcloud_target_size (int): Target size of the pointclouds.
             pointcloud_random_rotation (bool): If True pointclouds will be rotated randomly.
+            number_of_workers (int): Number of threads that are used for loading files.
+            cache_path (string): Where decoded images and preprocessed pointclouds and voxelgrids are stored as npy-files. None disables that.
+            max_cache_bytes (int): Upper bound for the size of each in-memory cache. None means no bound.
+            random_seed (int): Seed for sampling and augmentation. None seeds from the operating system.
 
         """
 
@@ -75,11 +88,10 @@ class DataGenerator(object):
         self.voxelgrid_random_rotation = voxelgrid_random_rotation
         self.pointcloud_target_size = pointcloud_target_size
         self.pointcloud_random_rotation = pointcloud_random_rotation
-
-        # Create some caches.
-        self.image_cache = {}
-        self.voxelgrid_cache = {}
-        self.pointcloud_cache = {}
+        self.number_of_workers = number_of_workers
+        self.cache_path = cache_path
+        self.max_cache_bytes = max_cache_bytes
+        self.random_seed = random_seed
 
         # Get all the paths.
         self._get_paths()
@@ -94,12 +106,37 @@ class DataGenerator(object):
         assert self.json_paths_personal != []
         assert self.json_paths_measures != []
 
-        # Find all QR-codes.
-        self._find_qrcodes()
+        # Select the loaders for the input-type once.
+        self._load_fn = {"image": self._load_image, "voxelgrid": self._load_voxelgrid, "pointcloud": self._load_pointcloud}[self.input_type]
+        self._sample_fn = {"image": self._sample_image, "voxelgrid": self._sample_voxelgrid, "pointcloud": self._sample_pointcloud}[self.input_type]
+
+        # Create some caches. They are bounded by the number of samples that fit into max_cache_bytes.
+        # The cached samples are held in RAM. Without a target size their size is unknown and the caches are unbounded.
+        cache_size = None
+        input_shape = self.get_input_shape()
+        if self.max_cache_bytes != None and None not in input_shape:
+            sample_bytes = np.prod(input_shape) * np.dtype(self._get_input_dtype()).itemsize
+            cache_size = max(1, int(self.max_cache_bytes // sample_bytes))
+        self.image_cache = LRUCache(cache_size)
+        self.voxelgrid_cache = LRUCache(cache_size)
+        self.pointcloud_cache = LRUCache(cache_size)
+        if self.cache_path != None and os.path.exists(self.cache_path) == False:
+            os.makedirs(self.cache_path)
+
+        # Find all QR-codes and create the QR-codes dictionary.
+        self._create_qrcodes_dictionary()
         assert self.qrcodes != [], "No QR-codes found!"
 
-        # Create the QR-codes dictionary.
-        self._create_qrcodes_dictionary()
+        # Find the measurements that have data for the input-type.
+        self._find_valid_measurements()
+
+        # Random numbers for sampling. They are drawn in batches.
+        self._random_state = np.random.RandomState(self.random_seed)
+
+        # No materialized dataset yet. See from_memmap.
+        self._x = None
+        self._y = None
+        self._x_qrcodes = None
 
 
     def _get_paths(self):
@@ -111,49 +148,59 @@ class DataGenerator(object):
 
         print(self.dataset_path)
 
-        # Getting the paths for images.
-        glob_search_path = os.path.join(self.dataset_path, "storage/person", "**/*.jpg")
-        self.jpg_paths = glob2.glob(glob_search_path)
-
-        # Getting the paths for point clouds.
-        glob_search_path = os.path.join(self.dataset_path, "storage/person", "**/*.pcd")
-        self.pcd_paths = glob2.glob(glob_search_path)
-
-        # Getting the paths for personal and measurement.
-        glob_search_path = os.path.join(self.dataset_path, "**/*.json")
-        json_paths = glob2.glob(glob_search_path)
-        self.json_paths_personal = [json_path for json_path in json_paths if "measures" not in json_path]
-        self.json_paths_measures = [json_path for json_path in json_paths if "measures" in json_path]
-        del json_paths
+        # Getting the paths for images, point clouds, personal and measurement in a single pass.
+        # Symlinked folders are followed. Datasets might live on mounted disks.
+        # Images and point clouds are only taken from the storage.
+        storage_path = os.path.join(self.dataset_path, "storage/person")
+        self.jpg_paths = []
+        self.pcd_paths = []
+        self.json_paths_personal = []
+        self.json_paths_measures = []
+        for root, _, file_names in os.walk(self.dataset_path, followlinks=True):
+            is_storage = root == storage_path or root.startswith(storage_path + os.sep)
+            for file_name in file_names:
+                file_path = os.path.join(root, file_name)
+                if file_name.endswith(".json"):
+                    if "measures" in file_path:
+                        self.json_paths_measures.append(file_path)
+                    else:
+                        self.json_paths_personal.append(file_path)
+                elif is_storage == True and file_name.endswith(".jpg"):
+                    self.jpg_paths.append(file_path)
+                elif is_storage == True and file_name.endswith(".pcd"):
+                    self.pcd_paths.append(file_path)
+
+        # Map QR-codes to JPGs and PCDs. The QR-code is the first folder in the storage.
+        self._jpg_by_qr = defaultdict(list)
+        for jpg_path in self.jpg_paths:
+            self._jpg_by_qr[self._extract_qrcode_from_path(jpg_path, storage_path)].append(jpg_path)
+        self._pcd_by_qr = defaultdict(list)
+        for pcd_path in self.pcd_paths:
+            self._pcd_by_qr[self._extract_qrcode_from_path(pcd_path, storage_path)].append(pcd_path)
+
+        # Map person-ids to personal JSONs. The person-id is the name of the folder that contains the JSON.
+        self._personal_by_pid = defaultdict(list)
+        for json_path in self.json_paths_personal:
+            if "ipynb_checkpoints" in json_path:
+                continue
+            person_id = os.path.basename(os.path.dirname(json_path))
+            self._personal_by_pid[person_id].append(json_path)
 
 
-    def _find_qrcodes(self):
+    def _extract_qrcode_from_path(self, file_path, storage_path):
         """
-        Finds all QR-codes.
-
-        Each individual is represented via a unique QR-codes. This method extracts the set of QR-codes.
+        Extracts a QR-code from a path in the storage.
         """
 
-        # Go through all the measures and extract their QR-codes.
-        qrcodes = []
-        for json_path_measure in self.json_paths_measures:
-            json_path_measure_file = open(json_path_measure)
-            json_data_measure = json.load(json_path_measure_file)
-            qrcode = self._extract_qrcode(json_data_measure)
-            qrcodes.append(qrcode)
-            json_path_measure_file.close()
-
-        # Provide a sorted set.
-        qrcodes = sorted(list(set(qrcodes)))
-
-        self.qrcodes = qrcodes
+        return os.path.relpath(file_path, storage_path).split(os.sep)[0]
 
 
     def _create_qrcodes_dictionary(self):
         """
-        Creates a QR-Code-dictionary.
+        Finds all QR-codes and creates a QR-Code-dictionary.
 
-        This basically sorts all PCDs and JPGs.
+        Each individual is represented via a unique QR-code. The sorted QR-codes of all measures are stored.
+        The dictionary basically sorts all PCDs and JPGs.
         With respect to the targets and the QR-Codes.
         This is used heavily during data generation.
         Takes into account timestamps in order to connect data and measures.
@@ -161,71 +208,143 @@ class DataGenerator(object):
 
         qrcodes_dictionary = {}
 
+        # The targets of all manual measurements go into one array. One row per measurement.
+        self._targets_array = np.zeros((len(self.json_paths_measures), len(self.output_targets)), dtype=np.float32)
+        self._target_rows_by_qrcode = {}
+        number_of_rows = 0
+
+        # Load all measures and their QR-codes in parallel. Each measure is loaded once.
+        self._qrcode_by_pid = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.number_of_workers) as executor:
+            json_datas_measure = list(executor.map(self._read_json, self.json_paths_measures))
+            qrcodes = list(executor.map(self._extract_qrcode, json_datas_measure))
+
         # Go thorugh all measures.
-        for json_path_measure in self.json_paths_measures:
+        for json_path_measure, json_data_measure, qrcode in zip(self.json_paths_measures, json_datas_measure, qrcodes):
 
-            # Load the data and get type.
-            measure_file = open(json_path_measure)
-            json_data_measure = json.load(measure_file)
+            # Get the type.
             measure_type = json_data_measure["type"]["value"]
-            measure_file.close()
 
             # Ensure manual data. If it is not a manual measurement, skip.
             if measure_type != "manual":
                 continue
 
-            # Extract the QR-code.
-            qrcode = self._extract_qrcode(json_data_measure)
-
             # Create an array in the dictionary if necessary.
             if qrcode not in qrcodes_dictionary.keys():
                 qrcodes_dictionary[qrcode] = []
+                self._target_rows_by_qrcode[qrcode] = []
 
-            # Extract the targets from the JSON-data.
-            targets = self._extract_targets(json_data_measure)
+            # Write the targets from the JSON-data into their row.
+            row = number_of_rows
+            number_of_rows += 1
+            self._targets_array[row, :] = self._extract_targets(json_data_measure)
+            targets = self._targets_array[row]
 
             # Extract the timestamp from the JSON-data.
             timestamp = self._extract_timestamp_from_path(json_path_measure)
 
             # Filter paths for qrcodes and measurements. Find all JPGs and PCDs for a given QR-code and make sure that the timestamps are related.
-            jpg_paths = [jpg_path for jpg_path in self.jpg_paths if self._is_matching_measurement(jpg_path, qrcode, timestamp) == True]
-            pcd_paths = [pcd_path for pcd_path in self.pcd_paths if self._is_matching_measurement(pcd_path, qrcode, timestamp) == True]
+            jpg_paths = [jpg_path for jpg_path in self._jpg_by_qr.get(qrcode, []) if self._is_matching_measurement(jpg_path, qrcode, timestamp) == True]
+            pcd_paths = [pcd_path for pcd_path in self._pcd_by_qr.get(qrcode, []) if self._is_matching_measurement(pcd_path, qrcode, timestamp) == True]
 
             # Store it all.
             qrcodes_dictionary[qrcode].append((targets, jpg_paths, pcd_paths))
+            self._target_rows_by_qrcode[qrcode].append(row)
 
+        self._targets_array = self._targets_array[:number_of_rows]
+        self.qrcodes = sorted(set(qrcodes))
         self.qrcodes_dictionary = qrcodes_dictionary
 
 
+    def _find_valid_measurements(self):
+        """
+        Finds all measurements that have data for the input-type and stores them as arrays.
+
+        A measurement is kept with the paths for the input-type only. That is, the JPGs for images and the PCDs otherwise.
+        The measurement-index is the row of the measurement in the targets-array. Paths are indexed by it, too.
+        The measurement-indices of each QR-code are stored by QR-code. QR-codes without measurements are left out.
+        This spares the generator from sampling them.
+        """
+
+        self._measurement_paths = [None] * len(self._targets_array)
+        self._measurements_by_qrcode = {}
+        for qrcode, measurements in self.qrcodes_dictionary.items():
+            measurement_indices = []
+            for row, (targets, jpg_paths, pcd_paths) in zip(self._target_rows_by_qrcode[qrcode], measurements):
+                file_paths = jpg_paths if self.input_type == "image" else pcd_paths
+                if len(file_paths) == 0:
+                    continue
+                measurement_indices.append(row)
+                self._measurement_paths[row] = np.array(file_paths)
+            if len(measurement_indices) != 0:
+                self._measurements_by_qrcode[qrcode] = np.array(measurement_indices)
+
+
+    def _get_measurement_groups(self, qrcodes):
+        """
+        Gets the measurement-indices for QR-codes. One group per QR-code that has data for the input-type.
+
+        The groups are concatenated into one array. Each group is given by its start and its length in that array.
+        """
+
+        groups = [self._measurements_by_qrcode[qrcode] for qrcode in qrcodes if qrcode in self._measurements_by_qrcode]
+        assert len(groups) != 0, "No data for the given QR-codes!"
+        group_lengths = np.array([len(group) for group in groups])
+        group_starts = np.cumsum(group_lengths) - group_lengths
+        return np.concatenate(groups), group_starts, group_lengths
+
+
+    def _draw_measurements(self, measurement_groups, size):
+        """
+        Draws the measurement-indices for a number of samples at once.
+
+        First a random QR-code is drawn for each sample. Then a random measurement of that QR-code.
+        """
+
+        measurement_indices, group_starts, group_lengths = measurement_groups
+        groups = self._random_state.randint(0, len(group_lengths), size=size)
+        offsets = (self._random_state.random_sample(size) * group_lengths[groups]).astype(int)
+        return measurement_indices[group_starts[groups] + offsets]
+
+
     def _extract_targets(self, json_data_measure):
         """
         Extracts a list of targets from JSON.
         """
 
-        targets = []
-        for output_target in self.output_targets:
-            value = json_data_measure[output_target]["value"]
-            targets.append(value)
-        return targets
+        return [json_data_measure[output_target]["value"] for output_target in self.output_targets]
 
 
     def _extract_qrcode(self, json_data_measure):
         """
         Extracts a QR-code from a JSON.
+
+        The personal JSON is read only once per person.
         """
 
         person_id = json_data_measure["personId"]["value"]
-        json_path_personal = [json_path for json_path in self.json_paths_personal if person_id in json_path]
-        json_path_personal = [json_path for json_path in json_path_personal if "ipynb_checkpoints" not in json_path]
+        qrcode = self._qrcode_by_pid.get(person_id, None)
+        if qrcode != None:
+            return qrcode
+        json_path_personal = self._personal_by_pid.get(person_id, [])
         assert len(json_path_personal) == 1, "Found {} jsons for person_id {}\n{}".format(len(json_path_personal), person_id, json_path_personal)
         json_path_personal = json_path_personal[0]
-        json_data_personal_file = open(json_path_personal)
-        json_data_personal = json.load(json_data_personal_file)
-        json_data_personal_file.close()
+        json_data_personal = self._read_json(json_path_personal)
         qrcode = json_data_personal["qrcode"]["value"]
+        self._qrcode_by_pid[person_id] = qrcode
         return qrcode
 
 
+    def _read_json(self, json_path):
+        """
+        Reads a JSON-file.
+        """
+
+        with open(json_path, "rb") as json_file:
+            json_data = json.loads(json_file.read())
+        return json_data
+
+
     def _is_matching_measurement(self, path, qrcode, timestamp, threshold=(60 * 60 * 24 * 1000)):
         """
         Returns True if timetamps match.
@@ -281,67 +400,168 @@ class DataGenerator(object):
         Makes use of a cache. Ensures that the loaded images has a target size.
         """
 
-        image = self.image_cache.get(image_path, [])
-        if image == []:
+        image = self._get_cached(self.image_cache, image_path, "image", self.image_target_shape)
+        if image is None:
             image = image_preprocessing.load_img(image_path, target_size=self.image_target_shape)
             image = image.rotate(-90, expand=True) # Rotation is necessary.
-            image = np.array(image)
-            self.voxelgrid_cache[image_path] = image
+            image = np.asarray(image)
+            image = self._set_cached(self.image_cache, image_path, image, "image", self.image_target_shape)
         return image
 
 
     def _load_pointcloud(self, pcd_path, preprocess=True, augmentation=True):
+        """
+        Loads a pointcloud from a given path.
 
-        pointcloud = self.pointcloud_cache.get(pcd_path, [])
-        if pointcloud == []:
-            pointcloud = PyntCloud.from_file(pcd_path).points.values
-            pointcloud = np.array(pointcloud)
+        Makes use of a cache. Only preprocessed pointclouds are cached. Augmentation is applied after the cache.
+        """
 
+        pointcloud = None
+        if preprocess == True:
+            pointcloud = self._get_cached(self.pointcloud_cache, pcd_path, "pointcloud", self.pointcloud_target_size)
+        if pointcloud is None:
             if self.pointcloud_target_size != None and preprocess == True:
-                pointcloud = pointcloud[:self.pointcloud_target_size]
+                pointcloud = utils.read_pcd_fast(pcd_path, self.pointcloud_target_size)
                 if len(pointcloud) < self.pointcloud_target_size:
-                    zeros = np.zeros((self.pointcloud_target_size - len(pointcloud), 4))
+                    zeros = np.zeros((self.pointcloud_target_size - len(pointcloud), pointcloud.shape[1]), dtype=pointcloud.dtype)
                     pointcloud = np.concatenate([pointcloud, zeros])
+            else:
+                pointcloud = utils.read_pcd_fast(pcd_path)
 
-            if self.pointcloud_random_rotation == True and augmentation==True:
-                numpy_points = pointcloud[:,0:3]
-                numpy_points = self._rotate_point_cloud(numpy_points)
-                pointcloud[:,0:3] = numpy_points
+            if preprocess == True:
+                pointcloud = self._set_cached(self.pointcloud_cache, pcd_path, pointcloud, "pointcloud", self.pointcloud_target_size)
+
+        if self.pointcloud_random_rotation == True and augmentation==True:
+            pointcloud = np.array(pointcloud) # Do not alter the cached pointcloud.
+            numpy_points = pointcloud[:,0:3]
+            numpy_points = self._rotate_point_cloud(numpy_points)
+            pointcloud[:,0:3] = numpy_points
 
-            #self.pointcloud_cache[pcd_path] = pointcloud
         return pointcloud
 
 
     def _load_voxelgrid(self, pcd_path, preprocess=True, augmentation=True):
-        voxelgrid = self.voxelgrid_cache.get(pcd_path, [])
-        if voxelgrid == []:
+        """
+        Loads a voxelgrid from a given path.
+
+        Makes use of a cache. Randomly rotated voxelgrids are not cached, since the rotation happens before voxelization.
+        Voxelgrids are float16.
+        """
+
+        use_cache = preprocess == True and (self.voxelgrid_random_rotation == False or augmentation == False)
+        voxelgrid = None
+        if use_cache == True:
+            voxelgrid = self._get_cached(self.voxelgrid_cache, pcd_path, "voxelgrid", self.voxel_size_meters, self.voxelgrid_target_shape, "float16")
+        if voxelgrid is None:
 
             # Load the pointcloud.
-            point_cloud = PyntCloud.from_file(pcd_path)
+            numpy_points = utils.read_pcd_fast(pcd_path)[:,0:3]
             if self.voxelgrid_random_rotation == True and augmentation == True:
-                points = point_cloud.points
-                numpy_points = points.values[:,0:3]
                 numpy_points = self._rotate_point_cloud(numpy_points)
-                points.iloc[:,0:3] = numpy_points
-                point_cloud.points = points
 
             # Create voxelgrid from pointcloud.
-            voxelgrid_id = point_cloud.add_structure("voxelgrid", size_x=self.voxel_size_meters, size_y=self.voxel_size_meters, size_z=self.voxel_size_meters)
-            voxelgrid = point_cloud.structures[voxelgrid_id].get_feature_vector(mode="density")
+            voxelgrid = utils.pointcloud_to_density_voxelgrid(numpy_points, self.voxel_size_meters)
 
             # Do the preprocessing.
             if preprocess == True:
                 voxelgrid = utils.ensure_voxelgrid_shape(voxelgrid, self.voxelgrid_target_shape)
                 assert voxelgrid.shape == self.voxelgrid_target_shape
 
-            #self.voxelgrid_cache[pcd_path] = voxelgrid # TODO cache is turned off because of you know why...
+            # Densities are in [0, 1]. Half precision is sufficient and halves the memory traffic.
+            voxelgrid = voxelgrid.astype(np.float16)
+
+            if use_cache == True:
+                voxelgrid = self._set_cached(self.voxelgrid_cache, pcd_path, voxelgrid, "voxelgrid", self.voxel_size_meters, self.voxelgrid_target_shape, "float16")
 
         return voxelgrid
 
 
+    def _get_cached(self, cache, file_path, *parameters):
+        """
+        Gets an array from the cache.
+
+        Checks the in-memory cache first and then the npy-files in the cache_path. Returns None if there is no entry.
+        A npy-file is loaded completely. Memory-maps would keep one file open per entry of the in-memory cache.
+        """
+
+        array = cache.get(file_path)
+        if array is None and self.cache_path != None:
+            npy_path = self._get_npy_path(file_path, *parameters)
+            if os.path.exists(npy_path):
+                array = np.load(npy_path)
+                array.flags.writeable = False
+                cache[file_path] = array
+        return array
+
+
+    def _set_cached(self, cache, file_path, array, *parameters):
+        """
+        Puts an array into the cache.
+
+        If there is a cache_path the array is also stored as an npy-file. The cached array is read-only.
+        """
+
+        if self.cache_path != None:
+            npy_path = self._get_npy_path(file_path, *parameters)
+            temporary_path = npy_path + "." + uuid.uuid4().hex + ".tmp"
+            with open(temporary_path, "wb") as npy_file:
+                np.save(npy_file, array)
+            os.replace(temporary_path, npy_path)
+        array.flags.writeable = False
+        cache[file_path] = array
+        return array
+
+
+    def _get_npy_path(self, file_path, *parameters):
+        """
+        Gets the path of the npy-file for a file and the parameters that were used for preprocessing it.
+        """
+
+        key = repr((file_path,) + parameters)
+        return os.path.join(self.cache_path, hashlib.md5(key.encode("utf-8")).hexdigest() + ".npy")
+
+
+    def _sample_image(self, jpg_paths):
+        """
+        Loads a random image. Returns the image and its path.
+        """
+
+        jpg_path = jpg_paths[self._random_state.randint(0, len(jpg_paths))]
+        image = self._load_image(jpg_path)
+        return image, jpg_path
+
+
+    def _sample_voxelgrid(self, pcd_paths):
+        """
+        Loads a random voxelgrid. Returns the voxelgrid and its path. Or None twice if loading fails.
+        """
+
+        pcd_path = pcd_paths[self._random_state.randint(0, len(pcd_paths))]
+        try:
+            voxelgrid = self._load_voxelgrid(pcd_path)
+        except Exception as e:
+            print(e)
+            return None, None
+        return voxelgrid, pcd_path
+
+
+    def _sample_pointcloud(self, pcd_paths):
+        """
+        Loads a random pointcloud. Returns the pointcloud and its path. Or None twice if loading fails.
+        """
+
+        pcd_path = pcd_paths[self._random_state.randint(0, len(pcd_paths))]
+        try:
+            pointcloud = self._load_pointcloud(pcd_path)
+        except Exception as e:
+            print(e)
+            return None, None
+        return pointcloud, pcd_path
+
+
     def _rotate_point_cloud(self, point_cloud):
 
-        rotation_angle = np.random.uniform() * 2 * np.pi
+        rotation_angle = self._random_state.uniform() * 2 * np.pi
         cosval = np.cos(rotation_angle)
         sinval = np.sin(rotation_angle)
         rotation_matrix = np.array([[cosval, sinval, 0],
@@ -371,16 +591,66 @@ class DataGenerator(object):
     def get_input_shape(self):
 
         if self.input_type == "image":
-            return (90, 160, 3)
+            return (self.image_target_shape[1], self.image_target_shape[0], 3) # Images are rotated.
 
         elif self.input_type == "voxelgrid":
-            return (32, 32, 32)
+            return tuple(self.voxelgrid_target_shape)
 
         elif self.input_type == "pointcloud":
-            return (32000, 4)
+            return (self.pointcloud_target_size, 4)
 
         else:
-            raise Exception("Unknown input_type: " + input_type)
+            raise Exception("Unknown input_type: " + self.input_type)
+
+
+    def _get_input_dtype(self):
+
+        return {"image": np.uint8, "voxelgrid": np.float16, "pointcloud": np.float32}[self.input_type]
+
+
+    def _create_batch_arrays(self, size):
+        """
+        Creates uninitialized arrays for the inputs and outputs of a batch.
+
+        Samples are written into these directly. This avoids stacking a list of samples.
+        """
+
+        sample_shape = self.get_input_shape()
+        if self.sequence_length != 0:
+            sample_shape = (self.sequence_length,) + sample_shape
+        x_inputs = self._create_inputs(size, sample_shape)
+        y_outputs = np.empty((size, len(self.output_targets)), dtype=np.float32)
+        return x_inputs, y_outputs
+
+
+    def _create_inputs(self, size, sample_shape):
+        """
+        Creates the inputs for a number of samples.
+
+        That is an uninitialized array. Without a target size the shape of the samples is unknown.
+        Then it is a list that has to be stacked with _stack_inputs.
+        """
+
+        if None in sample_shape:
+            return [None] * size
+        return np.empty((size,) + sample_shape, dtype=self._get_input_dtype())
+
+
+    def _stack_inputs(self, x_inputs):
+        """
+        Stacks a list of inputs into an array. Arrays are returned as they are.
+
+        Inputs of different shapes are stacked into an array of objects.
+        """
+
+        if isinstance(x_inputs, np.ndarray):
+            return x_inputs
+        if len(set([x_input.shape for x_input in x_inputs])) <= 1:
+            return np.array(x_inputs, dtype=self._get_input_dtype())
+        stacked_inputs = np.empty(len(x_inputs), dtype=object)
+        for index, x_input in enumerate(x_inputs):
+            stacked_inputs[index] = x_input
+        return stacked_inputs
 
 
     def get_output_size(self):
@@ -388,17 +658,37 @@ class DataGenerator(object):
         return len(self.output_targets)
 
 
-    def generate(self, size, qrcodes_to_use=None, verbose=False, yield_file_paths=False, multiprocessing_jobs=1):
+    def generate(self, size, qrcodes_to_use=None, verbose=False, yield_file_paths=False, multiprocessing_jobs=1, threading_jobs=1, prefetch_size=2):
 
         if qrcodes_to_use == None:
             qrcodes_to_use = self.qrcodes
+        if verbose == True:
+            print("Generating using QR-codes:", qrcodes_to_use)
+
+        # A materialized dataset is just sliced.
+        if self._x is not None:
+            assert yield_file_paths == False, "No file paths for a materialized dataset."
+            yield from self._generate_from_memmap(size, qrcodes_to_use)
+            return
+
+        measurement_groups = self._get_measurement_groups(qrcodes_to_use)
+
+        # Use multiple threads that prefetch batches in the background.
+        if threading_jobs > 1:
+            assert multiprocessing_jobs == 1, "Either use multiprocessing or threading."
+            batch_generator = PrefetchingBatchGenerator(self, size, measurement_groups, yield_file_paths, threading_jobs, prefetch_size)
+            try:
+                while True:
+                    yield next(batch_generator)
+            finally:
+                batch_generator.close()
 
         # Main loop.
         while True:
 
             # Use only a single process.
             if multiprocessing_jobs == 1:
-                yield generate_data(self, size, qrcodes_to_use, verbose, yield_file_paths, None)
+                yield generate_data(self, size, measurement_groups, verbose, yield_file_paths, None)
 
             # Use multiple processes.
             elif multiprocessing_jobs > 1:
@@ -413,11 +703,12 @@ class DataGenerator(object):
                 # Create an output_queue.
                 output_queue = mp.Queue()
 
-                # Create the processes.
+                # Create the processes. Each one gets its own seed. It is derived from the random state, so that the processes draw different samples in every batch.
                 processes = []
-                for subset_size in subset_sizes:
+                random_seeds = self._random_state.randint(0, 2 ** 31 - 1, size=len(subset_sizes))
+                for subset_size, random_seed in zip(subset_sizes, random_seeds):
                     process_target = generate_data
-                    process_args = (self, subset_size, qrcodes_to_use, verbose, yield_file_paths, output_queue)
+                    process_args = (self, subset_size, measurement_groups, verbose, yield_file_paths, output_queue, random_seed)
                     process = mp.Process(target=process_target, args=process_args)
                     processes.append(process)
 
@@ -479,67 +770,135 @@ class DataGenerator(object):
         if qrcodes_to_use == None:
             qrcodes_to_use = self.qrcodes
 
+        # Collect all files that have to be loaded.
         x_qrcodes = []
-        x_inputs = []
-        y_outputs = []
-        for index, qrcode in enumerate(qrcodes_to_use):
+        measurement_indices = []
+        file_paths = []
+        for qrcode in qrcodes_to_use:
 
             print("Processing:", qrcode)
 
             # Get targets and paths.
-            if qrcode not in  self.qrcodes_dictionary.keys():
+            if qrcode not in self._measurements_by_qrcode:
                 print("No data for:", qrcode)
                 continue
-            targets, jpg_paths, pcd_paths = self.qrcodes_dictionary[qrcode]
-            print(targets)
+            for measurement_index in self._measurements_by_qrcode[qrcode]:
+                for file_path in self._measurement_paths[measurement_index]:
+                    x_qrcodes.append(qrcode)
+                    measurement_indices.append(measurement_index)
+                    file_paths.append(file_path)
+
+        # Load the files in parallel with the loader for the input-type. Write them into one array.
+        x_inputs = self._create_inputs(len(file_paths), self.get_input_shape())
+        loaded = np.zeros(len(file_paths), dtype=bool)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.number_of_workers) as executor:
+            for index, x_input in enumerate(executor.map(self._try_load, file_paths)):
+                if x_input is not None:
+                    x_inputs[index] = x_input
+                    loaded[index] = True
+
+        # Leave out the files that could not be loaded.
+        x_qrcodes = np.array(x_qrcodes)
+        y_outputs = self._targets_array[np.array(measurement_indices, dtype=int)]
+        if np.all(loaded) == False:
+            x_qrcodes = x_qrcodes[loaded]
+            if isinstance(x_inputs, list):
+                x_inputs = [x_input for x_input, is_loaded in zip(x_inputs, loaded) if is_loaded]
+            else:
+                x_inputs = x_inputs[loaded]
+            y_outputs = y_outputs[loaded]
+        x_inputs = self._stack_inputs(x_inputs)
 
-            # Process image.
-            if self.input_type == "image":
+        return x_qrcodes, x_inputs, y_outputs
 
-                for jpg_path in jpg_paths:
-                    image = self._load_image(jpg_path)
-                    x_qrcodes.append(qrcode)
-                    x_inputs.append(image)
-                    y_outputs.append(targets)
 
+    def materialize(self, path, qrcodes_to_use=None):
+        """
+        Generates the whole dataset once and saves it as npy files.
 
-            # Process voxelgrid.
-            elif self.input_type == "voxelgrid":
+        The files can be memory-mapped with from_memmap. Generating batches then only slices them.
+        The parameters that determine the shapes of the inputs and outputs are stored alongside.
 
-                for pcd_path in pcd_paths:
-                    try:
-                        voxelgrid = self._load_voxelgrid(pcd_path)
-                    except Exception as e:
-                        print(e)
-                        print("Error:", pcd_path)
+        Args:
+            path (string): The directory to write the files to.
+            qrcodes_to_use (list): The QR-codes to use. All if None.
+        """
 
-                    x_qrcodes.append(qrcode)
-                    x_inputs.append(voxelgrid)
-                    y_outputs.append(targets)
+        x_qrcodes, x_inputs, y_outputs = self.generate_dataset(qrcodes_to_use)
+        assert x_inputs.dtype != object, "Samples of different shapes cannot be materialized. Set a target size."
+        if os.path.exists(path) == False:
+            os.makedirs(path)
+        np.save(os.path.join(path, "x.npy"), x_inputs)
+        np.save(os.path.join(path, "y.npy"), y_outputs)
+        np.save(os.path.join(path, "qrcodes.npy"), x_qrcodes)
+
+        # The dataset has no sequences. See generate_dataset.
+        parameters = {
+            "input_type": self.input_type,
+            "output_targets": self.output_targets,
+            "sequence_length": 0,
+            "image_target_shape": self.image_target_shape,
+            "voxelgrid_target_shape": self.voxelgrid_target_shape,
+            "voxel_size_meters": self.voxel_size_meters,
+            "pointcloud_target_size": self.pointcloud_target_size
+        }
+        with open(os.path.join(path, "parameters.p"), "wb") as parameters_file:
+            pickle.dump(parameters, parameters_file)
+
+
+    @classmethod
+    def from_memmap(cls, path, random_seed=None):
+        """
+        Creates a data-generator from a dataset that has been written with materialize.
 
-            # Process pointcloud.
-            elif self.input_type == "pointcloud":
+        The inputs and outputs are memory-mapped and not loaded into RAM.
+        Such a data-generator only supports generate.
 
-                for pcd_path in pcd_paths:
-                    try:
-                        pointcloud = self._load_pointcloud(pcd_path)
-                    except Exception as e:
-                        print(e)
-                        print("Error:", pcd_path)
-                        continue
+        Args:
+            path (string): The directory that contains the files.
+            random_seed (int): Seed for sampling. None seeds from the operating system.
+        """
 
-                    x_qrcodes.append(qrcode)
-                    x_inputs.append(pointcloud)
-                    y_outputs.append(targets)
+        datagenerator = cls.__new__(cls)
+        with open(os.path.join(path, "parameters.p"), "rb") as parameters_file:
+            for key, value in pickle.load(parameters_file).items():
+                setattr(datagenerator, key, value)
+        datagenerator._x = np.load(os.path.join(path, "x.npy"), mmap_mode="r")
+        datagenerator._y = np.load(os.path.join(path, "y.npy"), mmap_mode="r")
+        datagenerator._x_qrcodes = np.load(os.path.join(path, "qrcodes.npy"))
+        assert len(datagenerator._x) == len(datagenerator._y) == len(datagenerator._x_qrcodes)
+        assert datagenerator._x.shape[1:] == datagenerator.get_input_shape()
+        assert datagenerator._y.shape[1] == datagenerator.get_output_size()
+        datagenerator.qrcodes = sorted(set(datagenerator._x_qrcodes))
+        datagenerator.random_seed = random_seed
+        datagenerator._random_state = np.random.RandomState(random_seed)
+        return datagenerator
+
+
+    def _generate_from_memmap(self, size, qrcodes_to_use):
+        """
+        Generates batches by drawing random rows from the memory-mapped dataset.
+        """
 
-            else:
-                raise Exception("Unknown input_type: " + input_type)
+        indices = np.where(np.isin(self._x_qrcodes, qrcodes_to_use))[0]
+        assert len(indices) != 0, "No data for the given QR-codes!"
+        while True:
+            # Sorted rows are read from the disk in order.
+            batch_indices = np.sort(indices[self._random_state.randint(0, len(indices), size=size)])
+            yield np.asarray(self._x[batch_indices]), np.asarray(self._y[batch_indices])
 
-        x_qrcodes = np.array(x_qrcodes)
-        x_inputs = np.array(x_inputs)
-        y_outputs = np.array(y_outputs)
 
-        return x_qrcodes, x_inputs, y_outputs
+    def _try_load(self, file_path):
+        """
+        Loads a file with the loader for the input-type. Returns None if that fails.
+        """
+
+        try:
+            return self._load_fn(file_path)
+        except Exception as e:
+            print(e)
+            print("Error:", file_path)
+            return None
 
 
     def analyze_files(self):
@@ -711,31 +1070,67 @@ def test_parameters():
     print("Done.")
 
 
-def generate_data(class_self, size, qrcodes_to_use, verbose, yield_file_paths, output_queue):
-    if verbose == True:
-        print("Generating using QR-codes:", qrcodes_to_use)
-
+def generate_data(class_self, size, measurement_groups, verbose, yield_file_paths, output_queue, random_seed=None):
     assert size != 0
 
-    x_inputs = []
-    y_outputs = []
+    # A forked process would otherwise draw the same random numbers as its siblings.
+    if random_seed != None:
+        class_self._random_state = np.random.RandomState(random_seed)
+
+    x_inputs, y_outputs = class_self._create_batch_arrays(size)
     file_paths = []
+    measurement_indices = class_self._draw_measurements(measurement_groups, size)
 
     if verbose == True:
         bar = progressbar.ProgressBar(max_value=size)
-    while len(x_inputs) < size:
+    for index in range(size):
 
-        # Get a random QR-code.
-        qrcode = random.choice(qrcodes_to_use)
+        # Get a sample and write it into the batch.
+        x_input, y_output, file_path = generate_sample(class_self, measurement_groups, measurement_indices[index])
+        x_inputs[index] = x_input
+        y_outputs[index] = y_output
+        file_paths.append(file_path)
 
-        # Get targets and paths randomly.
-        if qrcode not in  class_self.qrcodes_dictionary.keys():
-            continue
-        targets, jpg_paths, pcd_paths = random.choice(class_self.qrcodes_dictionary[qrcode])
+        if verbose == True:
+            bar.update(len(file_paths))
+
+    if verbose == True:
+        bar.finish()
+    x_inputs = class_self._stack_inputs(x_inputs)
 
-        # No pointclouds.
-        if len(pcd_paths) == 0:
-            continue
+    # Prepare result values.
+    assert len(x_inputs) == size
+    assert len(y_outputs) == size
+    if yield_file_paths == False:
+        return_values =  (x_inputs, y_outputs)
+    else:
+        return_values = (x_inputs, y_outputs, file_paths)
+
+    # This is used in multiprocessing. Creates a pickle file and puts the data there.
+    if output_queue != None:
+        output_path = uuid.uuid4().hex + ".p"
+        pickle.dump(return_values, open(output_path, "wb"))
+        output_queue.put(output_path)
+    else:
+        return return_values
+
+
+def generate_sample(class_self, measurement_groups, measurement_index):
+    """
+    Generates a single sample for a measurement.
+
+    Expects the measurement-groups, as provided by _get_measurement_groups, and a measurement drawn from them.
+    If loading the data fails, another measurement is drawn.
+
+    Returns:
+        tuple: The input, the targets, and the file path(s) of the input.
+    """
+
+    while True:
+
+        # The measurement is known to have data.
+        targets = class_self._targets_array[measurement_index]
+        file_paths = class_self._measurement_paths[measurement_index]
 
         # Get a sample.
         x_input = None
@@ -744,14 +1139,14 @@ def generate_data(class_self, size, qrcodes_to_use, verbose, yield_file_paths, o
 
         # Get the input. Not dealing with sequences.
         if class_self.sequence_length == 0:
-            x_input, file_path = get_input(class_self, jpg_paths, pcd_paths)
+            x_input, file_path = class_self._sample_fn(file_paths)
 
         # Get the input. Dealing with sequences here.
         else:
             count = 0
             x_input, file_path = [], []
             while count != class_self.sequence_length:
-                x, f = get_input(class_self, jpg_paths, pcd_paths)
+                x, f = class_self._sample_fn(file_paths)
                 if x is not None and f is not None:
                     x_input.append(x)
                     file_path.append(f)
@@ -762,88 +1157,146 @@ def generate_data(class_self, size, qrcodes_to_use, verbose, yield_file_paths, o
         # Set the output.
         y_output = targets
 
-
         # Got a proper sample.
         if x_input is not None and y_output is not None and file_path is not None:
-            x_inputs.append(x_input)
-            y_outputs.append(y_output)
-            file_paths.append(file_path)
+            return x_input, y_output, file_path
 
-        assert len(x_inputs) == len(y_outputs)
-        assert len(y_outputs) == len(file_paths)
+        # Try another measurement.
+        measurement_index = class_self._draw_measurements(measurement_groups, 1)[0]
 
-        if verbose == True:
-            bar.update(len(x_inputs))
 
-    if verbose == True:
-        bar.finish()
+class LRUCache(object):
+    """
+    A thread-safe cache with a maximum number of entries.
 
-    assert len(x_inputs) == size
-    assert len(y_outputs) == size
+    When the cache is full, the least recently used entry is dropped.
+    """
 
-    # Turn everything into ndarrays.
-    x_inputs = np.array(x_inputs)
-    y_outputs = np.array(y_outputs)
+    def __init__(self, maximum_size=None):
+        """
+        Initializes an LRUCache.
 
-    # Prepare result values.
-    assert len(x_inputs) == size
-    assert len(y_outputs) == size
-    if yield_file_paths == False:
-        return_values =  (x_inputs, y_outputs)
-    else:
-        return_values = (x_inputs, y_outputs, file_paths)
+        Args:
+            maximum_size (int): Maximum number of entries. None means no bound.
+        """
 
-    # This is used in multiprocessing. Creates a pickle file and puts the data there.
-    if output_queue != None:
-        output_path = uuid.uuid4().hex + ".p"
-        pickle.dump(return_values, open(output_path, "wb"))
-        output_queue.put(output_path)
-    else:
-        return return_values
+        self.maximum_size = maximum_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
 
 
-def get_input(class_self, jpg_paths, pcd_paths):
-    # Get a random image.
-    if class_self.input_type == "image":
-        if len(jpg_paths) == 0:
-            print("777")
-            return None, None
-        jpg_path = random.choice(jpg_paths)
-        image = class_self._load_image(jpg_path)
-        file_path = jpg_path
-        x_input = image
-
-    # Get a random voxelgrid.
-    elif class_self.input_type == "voxelgrid":
-        if len(pcd_paths) == 0:
-            return None, None
-        pcd_path = random.choice(pcd_paths)
-        try:
-            voxelgrid = class_self._load_voxelgrid(pcd_path)
-            file_path = pcd_path
-            x_input = voxelgrid
-        except Exception as e:
-            print(e)
-            return None, None
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.entries:
+                return default
+            self.entries.move_to_end(key)
+            return self.entries[key]
 
-    # Get a random pointcloud.
-    elif class_self.input_type == "pointcloud":
-        if len(pcd_paths) == 0:
-            return None, None
-        pcd_path = random.choice(pcd_paths)
-        try:
-            pointcloud = class_self._load_pointcloud(pcd_path)
-            file_path = pcd_path
-            x_input = pointcloud
-        except Exception as e:
-            print(e)
-            return None, None
 
-    # Should not happen.
-    else:
-        raise Exception("Unknown input_type: " + input_type)
+    def __setitem__(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            if self.maximum_size != None:
+                while len(self.entries) > self.maximum_size:
+                    self.entries.popitem(last=False)
+
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+
+    def __getstate__(self):
+        """
+        Pickles the cache without its entries and its lock. This is used when starting processes.
+        """
+
+        return {"maximum_size": self.maximum_size}
+
+
+    def __setstate__(self, state):
+        self.__init__(state["maximum_size"])
+
+
+class PrefetchingBatchGenerator(object):
+    """
+    Generates batches with a pool of threads.
+
+    Every batch is a list of futures, one per sample. A fixed number of batches is kept in flight,
+    so that loading the next batches overlaps with consuming the current one.
+    Threads are sufficient, because loading is dominated by file-IO and numpy, which release the GIL.
+    """
+
+    def __init__(self, class_self, size, measurement_groups, yield_file_paths, threading_jobs, prefetch_size):
+        """
+        Initializes a PrefetchingBatchGenerator.
+
+        Args:
+            class_self (DataGenerator): The data-generator that provides the samples.
+            size (int): Number of samples per batch.
+            measurement_groups (tuple): Measurement-groups to sample from, as provided by _get_measurement_groups.
+            yield_file_paths (bool): If True, the file paths are yielded alongside the batches.
+            threading_jobs (int): Number of threads.
+            prefetch_size (int): Number of batches that are kept in flight.
+        """
+
+        assert size != 0
+        assert prefetch_size > 0, "prefetch_size must be positive: " + str(prefetch_size)
+
+        self.class_self = class_self
+        self.size = size
+        self.measurement_groups = measurement_groups
+        self.yield_file_paths = yield_file_paths
+        self.prefetch_size = prefetch_size
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=threading_jobs)
+        self.pending_batches = deque()
+
+
+    def __iter__(self):
+        return self
+
+
+    def __next__(self):
+
+        # Fill the prefetch-queue.
+        while len(self.pending_batches) < self.prefetch_size + 1:
+            self.pending_batches.append(self._submit_batch())
+
+        # Wait for the oldest batch.
+        futures = self.pending_batches.popleft()
+
+        # Write the samples into the batch.
+        x_inputs, y_outputs = self.class_self._create_batch_arrays(self.size)
+        file_paths = []
+        for index, future in enumerate(futures):
+            x_input, y_output, file_path = future.result()
+            x_inputs[index] = x_input
+            y_outputs[index] = y_output
+            file_paths.append(file_path)
+        x_inputs = self.class_self._stack_inputs(x_inputs)
+
+        if self.yield_file_paths == False:
+            return x_inputs, y_outputs
+        else:
+            return x_inputs, y_outputs, file_paths
+
+
+    def _submit_batch(self):
+        measurement_indices = self.class_self._draw_measurements(self.measurement_groups, self.size)
+        return [self.executor.submit(generate_sample, self.class_self, self.measurement_groups, measurement_index) for measurement_index in measurement_indices]
+
+
+    def close(self):
+        """
+        Cancels the pending batches and stops the threads.
+        """
 
-    return x_input, file_path
+        for futures in self.pending_batches:
+            for future in futures:
+                future.cancel()
+        self.pending_batches.clear()
+        self.executor.shutdown(wait=False)
 
 
 def create_datagenerator_from_parameters(dataset_path, dataset_parameters):
@@ -857,7 +1310,10 @@ def create_datagenerator_from_parameters(dataset_path, dataset_parameters):
         voxel_size_meters=dataset_parameters.get("voxel_size_meters", None),
         voxelgrid_random_rotation=dataset_parameters.get("voxelgrid_random_rotation", None),
         pointcloud_target_size=dataset_parameters.get("pointcloud_target_size", None),
-        pointcloud_random_rotation=dataset_parameters.get("pointcloud_random_rotation", None)
+        pointcloud_random_rotation=dataset_parameters.get("pointcloud_random_rotation", None),
+        cache_path=dataset_parameters.get("cache_path", None),
+        max_cache_bytes=dataset_parameters.get("max_cache_bytes", 2 ** 32),
+        random_seed=dataset_parameters.get("random_seed", None)
     )
     #datagenerator.print_statistics()
     return datagenerator
@@ -11,6 +11,10 @@ try:
 except Exception as e:
     pass
     #print("WARNING! VTK not available. This might limit the functionality.") 
+try:
+    import numba
+except ImportError:
+    numba = None
 from pyntcloud import PyntCloud
 import pickle
 import random
@@ -24,6 +28,63 @@ def load_pcd_as_ndarray(pcd_path):
         
     return PyntCloud.from_file(pcd_path).points.values
 
+def read_pcd_fast(pcd_path, target_size=None):
+    """
+    Reads the points of a PCD-file into an array with one column per value.
+
+    Parses the header once and reads the body with numpy. Supports ascii and binary data.
+    Other formats are read with PyntCloud.
+
+    Args:
+        pcd_path (string): Path to the PCD-file.
+        target_size (int): Reads at most this many points. None reads all points.
+
+    Returns:
+        ndarray: The points as float32.
+    """
+
+    with open(pcd_path, "rb") as pcd_file:
+
+        # Parse the header. It ends with the DATA-line.
+        header = {}
+        while "DATA" not in header:
+            line = pcd_file.readline()
+            assert line != b"", "No DATA in header of " + pcd_path
+            line = line.decode("ascii").strip()
+            if line == "" or line.startswith("#"):
+                continue
+            key, _, value = line.partition(" ")
+            header[key.upper()] = value.split()
+
+        # Determine what to read.
+        if "POINTS" in header:
+            number_of_points = int(header["POINTS"][0])
+        else:
+            number_of_points = int(header["WIDTH"][0]) * int(header["HEIGHT"][0])
+        if target_size != None:
+            number_of_points = min(number_of_points, target_size)
+        counts = [int(count) for count in header.get("COUNT", ["1"] * len(header["FIELDS"]))]
+        data_type = header["DATA"][0].lower()
+
+        # Read the body.
+        if number_of_points == 0:
+            pointcloud = np.zeros((0, sum(counts)), dtype=np.float32)
+        elif data_type == "ascii":
+            lines = itertools.islice(pcd_file, number_of_points)
+            pointcloud = np.loadtxt(lines, dtype=np.float32, ndmin=2)
+        elif data_type == "binary":
+            dtype = np.dtype([
+                ("f" + str(index), "<" + field_type.lower() + size, (count,))
+                for index, (field_type, size, count) in enumerate(zip(header["TYPE"], header["SIZE"], counts))
+            ])
+            records = np.fromfile(pcd_file, dtype=dtype, count=number_of_points)
+            pointcloud = np.concatenate([records[name].astype(np.float32) for name in dtype.names], axis=1)
+        else:
+            pointcloud = PyntCloud.from_file(pcd_path).points.values
+            pointcloud = np.ascontiguousarray(pointcloud[:number_of_points], dtype=np.float32)
+
+    return pointcloud
+
 def subsample_pointcloud(pointcloud, target_size):
     """
     Yields a subsampled pointcloud.
@@ -76,6 +137,59 @@ def render_pointcloud(points, title=None):
     plt.close()
 
 
+def pointcloud_to_density_voxelgrid(points, voxel_size_meters):
+    """
+    Creates a voxelgrid from a pointcloud. Each voxel holds the fraction of points that fall into it.
+
+    Uses the same bounding box as the pyntcloud-voxelgrid with regular_bounding_box=True.
+    That is, the box is made cubic and then padded so that the voxels have the given size.
+    """
+
+    points = np.asarray(points[:, 0:3], dtype=np.float64)
+
+    # Compute the bounding box.
+    xyzmin = points.min(0)
+    xyzmax = points.max(0)
+    extents = xyzmax - xyzmin
+    margin = max(extents) - extents
+    xyzmin = xyzmin - margin / 2
+    xyzmax = xyzmax + margin / 2
+    margin = ((extents // voxel_size_meters) + 1) * voxel_size_meters - extents
+    xyzmin = xyzmin - margin / 2
+    xyzmax = xyzmax + margin / 2
+    voxelgrid_shape = ((xyzmax - xyzmin) / voxel_size_meters).astype(int)
+
+    # Rounding can leave no voxel at all if all points are the same.
+    voxelgrid_shape = np.maximum(voxelgrid_shape, 1)
+
+    # Count the points per voxel. Compiled if numba is available.
+    if numba != None:
+        scales = voxelgrid_shape / (xyzmax - xyzmin)
+        voxelgrid = _count_points_per_voxel(np.ascontiguousarray(points), xyzmin, scales, voxelgrid_shape[0], voxelgrid_shape[1], voxelgrid_shape[2])
+        voxelgrid = voxelgrid.astype(np.float64)
+    else:
+        voxelgrid, _ = np.histogramdd(points, bins=voxelgrid_shape, range=list(zip(xyzmin, xyzmax)))
+    voxelgrid /= len(points)
+    return voxelgrid
+
+
+if numba != None:
+    # Serial on purpose. It is called from the thread pools of the data-generator, which already run in parallel.
+    @numba.njit(cache=True)
+    def _count_points_per_voxel(points, xyzmin, scales, n_x, n_y, n_z):
+        """
+        Counts the points per voxel.
+        """
+
+        counts = np.zeros((n_x, n_y, n_z), dtype=np.int64)
+        for index in range(points.shape[0]):
+            x = min(max(int((points[index, 0] - xyzmin[0]) * scales[0]), 0), n_x - 1)
+            y = min(max(int((points[index, 1] - xyzmin[1]) * scales[1]), 0), n_y - 1)
+            z = min(max(int((points[index, 2] - xyzmin[2]) * scales[2]), 0), n_z - 1)
+            counts[x, y, z] += 1
+        return counts
+
+
 def ensure_voxelgrid_shape(voxelgrid, voxelgrid_target_shape):
     voxelgrid = pad_voxelgrid(voxelgrid, voxelgrid_target_shape)
     voxelgrid = crop_voxelgrid(voxelgrid, voxelgrid_target_shape)
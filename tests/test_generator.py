@@ -1,5 +1,12 @@
 import unittest
-from cgmcore.datagenerator import DataGenerator, get_dataset_path, create_datagenerator_from_parameters
+import os
+import json
+import pickle
+import shutil
+import tempfile
+import numpy as np
+from cgmcore.datagenerator import DataGenerator, LRUCache, get_dataset_path, create_datagenerator_from_parameters
+from tests.test_utils import write_pcd
 
 
 class TestGenerator(unittest.TestCase):
@@ -60,5 +67,119 @@ class TestGenerator(unittest.TestCase):
         assert dataset[0].shape == (1, 8, 32, 32, 32)
 
 
+def create_synthetic_dataset(dataset_path, qrcodes, pointcloud_size=5):
+    """
+    Writes a tiny raw dataset. One person with one manual measurement and two PCDs per QR-code.
+    """
+
+    timestamp = "1536000000000"
+    for index, qrcode in enumerate(qrcodes):
+        person_id = "person" + str(index)
+        person_path = os.path.join(dataset_path, "person", person_id)
+        os.makedirs(os.path.join(person_path, "measures"))
+        with open(os.path.join(person_path, "personal.json"), "w") as json_file:
+            json.dump({"qrcode": {"value": qrcode}}, json_file)
+        measure = {
+            "type": {"value": "manual"},
+            "personId": {"value": person_id},
+            "height": {"value": 80.0 + index},
+            "weight": {"value": 9.0 + index}
+        }
+        with open(os.path.join(person_path, "measures", "measure_" + str(index) + "_" + timestamp + "_0.json"), "w") as json_file:
+            json.dump(measure, json_file)
+
+        pcd_folder = os.path.join(dataset_path, "storage", "person", qrcode, "measurements", timestamp, "pc")
+        os.makedirs(pcd_folder)
+        for pcd_index in range(2):
+            points = np.full((pointcloud_size, 4), index, dtype=np.float32)
+            write_pcd(os.path.join(pcd_folder, "pc_" + qrcode + "_" + timestamp + "_" + str(pcd_index) + ".pcd"), points)
+
+
+class TestMaterialize(unittest.TestCase):
+
+    def setUp(self):
+        self.temporary_path = tempfile.mkdtemp()
+        self.dataset_path = os.path.join(self.temporary_path, "dataset")
+        create_synthetic_dataset(self.dataset_path, ["QR1", "QR2", "QR3"])
+
+
+    def tearDown(self):
+        shutil.rmtree(self.temporary_path)
+
+
+    def test_round_trip(self):
+        data_generator = DataGenerator(dataset_path=self.dataset_path, input_type="pointcloud", output_targets=["height", "weight"], pointcloud_target_size=8, random_seed=666)
+        materialized_path = os.path.join(self.temporary_path, "materialized")
+        data_generator.materialize(materialized_path)
+
+        memmap_generator = DataGenerator.from_memmap(materialized_path, random_seed=666)
+        assert memmap_generator.qrcodes == ["QR1", "QR2", "QR3"]
+        assert memmap_generator.get_input_shape() == (8, 4)
+        assert memmap_generator.get_output_size() == 2
+
+        x_inputs, y_outputs = next(memmap_generator.generate(size=16, qrcodes_to_use=["QR2"]))
+        assert x_inputs.shape == (16, 8, 4)
+        assert x_inputs.dtype == np.float32
+        assert y_outputs.shape == (16, 2)
+        assert y_outputs.dtype == np.float32
+        np.testing.assert_array_equal(x_inputs[:, :5], 1.0)
+        np.testing.assert_array_equal(x_inputs[:, 5:], 0.0)
+        np.testing.assert_array_equal(y_outputs, [[81.0, 10.0]] * 16)
+
+
+    def test_without_pointcloud_target_size(self):
+        data_generator = DataGenerator(dataset_path=self.dataset_path, input_type="pointcloud", output_targets=["height", "weight"], pointcloud_target_size=None)
+        x_inputs, y_outputs = next(data_generator.generate(size=4))
+        assert x_inputs.shape == (4, 5, 4)
+        assert y_outputs.shape == (4, 2)
+        _, x_inputs, y_outputs = data_generator.generate_dataset()
+        assert x_inputs.shape == (6, 5, 4)
+        assert y_outputs.shape == (6, 2)
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_get_and_set(self):
+        cache = LRUCache(2)
+        assert cache.get("a") == None
+        assert cache.get("a", 0) == 0
+        cache["a"] = 1
+        cache["a"] = 2
+        assert cache.get("a") == 2
+        assert len(cache) == 1
+
+
+    def test_eviction_order(self):
+        cache = LRUCache(2)
+        cache["a"] = 1
+        cache["b"] = 2
+        cache.get("a")
+        cache["c"] = 3
+        assert len(cache) == 2
+        assert cache.get("b") == None
+        assert cache.get("a") == 1
+        assert cache.get("c") == 3
+        cache["b"] = 2
+        assert cache.get("a") == None
+
+
+    def test_pickle(self):
+        cache = LRUCache(2)
+        cache["a"] = 1
+        cache = pickle.loads(pickle.dumps(cache))
+        assert cache.maximum_size == 2
+        assert len(cache) == 0
+        cache["b"] = 2
+        assert cache.get("b") == 2
+
+
+    def test_unbounded(self):
+        cache = LRUCache()
+        for index in range(1000):
+            cache[index] = index
+        assert len(cache) == 1000
+        assert cache.get(0) == 0
+
+
 if __name__ == '__main__':
     unittest.main()
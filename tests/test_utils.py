@@ -0,0 +1,129 @@
+import unittest
+from unittest import mock
+import concurrent.futures
+import os
+import shutil
+import tempfile
+import numpy as np
+from cgmcore import utils
+
+
+def write_pcd(pcd_path, points, fields=("x", "y", "z", "c"), types=("F", "F", "F", "F"), data="ascii", records=None):
+    """
+    Writes a PCD-file. Binary data is taken from the records.
+    """
+
+    header = [
+        "# .PCD v0.7 - Point Cloud Data file format",
+        "VERSION 0.7",
+        "FIELDS " + " ".join(fields),
+        "SIZE " + " ".join(["4"] * len(fields)),
+        "TYPE " + " ".join(types),
+        "COUNT " + " ".join(["1"] * len(fields)),
+        "WIDTH " + str(len(points)),
+        "HEIGHT 1",
+        "VIEWPOINT 0 0 0 1 0 0 0",
+        "POINTS " + str(len(points)),
+        "DATA " + data
+    ]
+    with open(pcd_path, "wb") as pcd_file:
+        pcd_file.write(("\n".join(header) + "\n").encode("ascii"))
+        if data == "ascii":
+            for point in points:
+                pcd_file.write((" ".join([str(value) for value in point]) + "\n").encode("ascii"))
+        else:
+            pcd_file.write(records.tobytes())
+
+
+class TestUtils(unittest.TestCase):
+
+    def create_pointclouds(self):
+        random_state = np.random.RandomState(666)
+        return [random_state.uniform(-1.0, 1.0, size=(1000, 4)) * scale for scale in [0.5, 1.0, 2.0, 3.0]]
+
+
+    def create_histogram_voxelgrid(self, points, voxel_size_meters):
+        with mock.patch.object(utils, "numba", None):
+            return utils.pointcloud_to_density_voxelgrid(points, voxel_size_meters)
+
+
+    def test_density_voxelgrid(self):
+        for points in self.create_pointclouds():
+            voxelgrid = utils.pointcloud_to_density_voxelgrid(points, 0.1)
+            expected_voxelgrid = self.create_histogram_voxelgrid(points, 0.1)
+            assert voxelgrid.shape == expected_voxelgrid.shape
+            np.testing.assert_array_equal(voxelgrid, expected_voxelgrid)
+            np.testing.assert_almost_equal(voxelgrid.sum(), 1.0)
+
+
+    def test_density_voxelgrid_in_threads(self):
+        pointclouds = self.create_pointclouds() * 8
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+            voxelgrids = list(executor.map(lambda points: utils.pointcloud_to_density_voxelgrid(points, 0.1), pointclouds))
+        for points, voxelgrid in zip(pointclouds, voxelgrids):
+            np.testing.assert_array_equal(voxelgrid, self.create_histogram_voxelgrid(points, 0.1))
+
+
+    def test_density_voxelgrid_of_identical_points(self):
+        for value in [0.0, 1.0, 3.0, 7.3]:
+            points = np.full((10, 4), value)
+            voxelgrid = utils.pointcloud_to_density_voxelgrid(points, 0.1)
+            assert voxelgrid.shape == (1, 1, 1)
+            np.testing.assert_array_equal(voxelgrid, self.create_histogram_voxelgrid(points, 0.1))
+            np.testing.assert_almost_equal(voxelgrid.sum(), 1.0)
+
+
+class TestReadPCD(unittest.TestCase):
+
+    def setUp(self):
+        self.temporary_path = tempfile.mkdtemp()
+
+
+    def tearDown(self):
+        shutil.rmtree(self.temporary_path)
+
+
+    def read_pcd(self, points, target_size=None, **kwargs):
+        pcd_path = os.path.join(self.temporary_path, "test.pcd")
+        write_pcd(pcd_path, points, **kwargs)
+        return utils.read_pcd_fast(pcd_path, target_size)
+
+
+    def test_ascii(self):
+        points = np.arange(20, dtype=np.float32).reshape(5, 4) / 4
+        pointcloud = self.read_pcd(points)
+        assert pointcloud.dtype == np.float32
+        np.testing.assert_array_equal(pointcloud, points)
+
+
+    def test_binary_with_mixed_types(self):
+        dtype = np.dtype([("x", "<f4"), ("y", "<f4"), ("z", "<f4"), ("c", "<u4")])
+        records = np.zeros(5, dtype=dtype)
+        for name in ["x", "y", "z"]:
+            records[name] = np.linspace(-1.0, 1.0, 5)
+        records["c"] = [0, 1, 255, 65536, 4294967295]
+        pointcloud = self.read_pcd(records, types=("F", "F", "F", "U"), data="binary", records=records)
+        assert pointcloud.dtype == np.float32
+        assert pointcloud.shape == (5, 4)
+        for index, name in enumerate(dtype.names):
+            np.testing.assert_array_equal(pointcloud[:, index], records[name].astype(np.float32))
+
+
+    def test_target_size(self):
+        points = np.arange(40, dtype=np.float32).reshape(10, 4)
+        np.testing.assert_array_equal(self.read_pcd(points, target_size=3), points[:3])
+        np.testing.assert_array_equal(self.read_pcd(points, target_size=20), points)
+
+        records = points.view([("x", "<f4"), ("y", "<f4"), ("z", "<f4"), ("c", "<f4")]).reshape(-1)
+        np.testing.assert_array_equal(self.read_pcd(points, target_size=3, data="binary", records=records), points[:3])
+
+
+    def test_single_point(self):
+        points = np.array([[1.0, 2.0, 3.0, 4.0]], dtype=np.float32)
+        pointcloud = self.read_pcd(points)
+        assert pointcloud.shape == (1, 4)
+        np.testing.assert_array_equal(pointcloud, points)
+
+
+if __name__ == '__main__':
+    unittest.main()